@@ -1,15 +1,95 @@
+import numpy as np
 import pandas as pd
 from pyomo.environ import (
-    ConcreteModel, Set, Var, Binary, Constraint, Objective, maximize, SolverFactory, inequality
+    ConcreteModel, Set, Var, Binary, Constraint, Objective, maximize, SolverFactory, inequality,
+    quicksum
 )
+import contextlib
+import hashlib
 import os
+import traceback
+from collections import defaultdict
+
+try:
+    from numba import vectorize
+except ImportError:
+    vectorize = None
 
 # --- 1. Einlesen der Daten ---
-students = pd.read_excel("studierende.xlsx", sheet_name="Alle Studierende")
-unis = pd.read_excel("unis.xlsx", sheet_name="Alle Universitäten")
+def load_excel(path, sheet_name, **kwargs):
+    # Geparste Tabelle je Tabellenblatt als Parquet neben der Excel-Datei zwischenspeichern.
+    # Der Cache gilt nur, solange er neuer als die Excel-Datei und (wenn als Skript ausgeführt)
+    # als dieses Skript ist, damit geänderte usecols/dtype nicht mit einem alten Stand weiterlaufen.
+    cache = f"{path}.{hashlib.sha1(sheet_name.encode()).hexdigest()[:8]}.parquet"
+    quellen = [path] + ([__file__] if '__file__' in globals() else [])
+    if os.path.exists(cache) and os.path.getmtime(cache) > max(map(os.path.getmtime, quellen)):
+        try:
+            return pd.read_parquet(cache)
+        except Exception as e:
+            print("Parquet-Cache unlesbar, lese Excel neu:", e)
+    df = pd.read_excel(path, sheet_name=sheet_name, engine="openpyxl", **kwargs)
+    # Erst vollständig in eine temporäre Datei schreiben, dann atomar ersetzen
+    tmp = cache + '.tmp'
+    try:
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, cache)
+    except Exception as e:
+        # Der Cache ist optional (z. B. ohne pyarrow oder in einem schreibgeschützten Verzeichnis)
+        print("Parquet-Cache nicht geschrieben:", e)
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+    return df
+
+students = load_excel(
+    "studierende.xlsx",
+    sheet_name="Alle Studierende",
+    usecols=[
+        'Matrikelnummer', 'Level', 'Semesterwahl', 'BesondereChance:Behinderung',
+        'BesondereChance:Kind', 'Note', 'Motivation', 'Sprache', 'Lebenslauf',
+        'Formalien', 'ECTS', 'Programm',
+    ],
+    dtype={
+        'Matrikelnummer': 'int64',
+        'Level': 'category',
+        'Semesterwahl': 'category',
+        'BesondereChance:Behinderung': 'string',
+        'BesondereChance:Kind': 'string',
+        'Note': 'float64',
+        'Motivation': 'float32',
+        'Sprache': 'category',
+        'Lebenslauf': 'float32',
+        'Formalien': 'float32',
+        'ECTS': 'int32',
+    },
+)
+unis = load_excel(
+    "unis.xlsx",
+    sheet_name="Alle Universitäten",
+    usecols=lambda c: c in {
+        'ArbeitsnameUni', 'Status', 'GleicheAufteilungWISESOSE',
+        'MaxBachelor', 'MaxMaster', 'MaxBeide',
+    } or c.startswith('Programm-'),
+    # Alle übrigen Spalten (Name, Flags, Programm-*) als Text; to_bool() wandelt die Flags um
+    dtype=defaultdict(lambda: 'string', {
+        'Status': 'category',
+        'MaxBachelor': 'int32',
+        'MaxMaster': 'int32',
+        'MaxBeide': 'int32',
+    }),
+)
 
 # Universitäten mit aktuellem Aufnahmestopp entfernen
-unis = unis[unis['Status'] != 'Pausiert']
+unis = unis[unis['Status'] != 'Pausiert'].copy()
+
+# Wahrheitswerte liegen in den Excel-Dateien als Text ('true'/'false') vor
+def to_bool(series):
+    return series.astype('string').str.lower().isin(['wahr', 'true', '1'])
+
+for col in ['BesondereChance:Behinderung', 'BesondereChance:Kind']:
+    students[col] = to_bool(students[col])
+
+for col in ['GleicheAufteilungWISESOSE'] + [c for c in unis.columns if c.startswith('Programm-')]:
+    unis[col] = to_bool(unis[col])
 
 # --- 2. Bewertung der Studierenden ---
 weights = {
@@ -20,101 +100,146 @@ weights = {
     'Formalien': 0.05,
 }
 
-def normalize_note(note):
-    return (5.0 - note) / 4.0
+# Normierung der Kriterien spaltenweise über alle Studierenden
+sprache_mapping = {'C2': 1.0, 'C1': 0.8, 'B2': 0.6, 'B1': 0.4, 'A2': 0.2, 'A1': 0.0}
 
-def normalize_motivation(motivation):
-    return (3 - motivation) / 2.0
+# Zu- und Abschlag für besondere Chancen bzw. Bachelor mit < 60 ECTS
+bonus_punkte = 0.6
+malus_punkte = 0.2
 
-def normalize_sprache(sprache):
-    mapping = {'C2': 1.0, 'C1': 0.8, 'B2': 0.6, 'B1': 0.4, 'A2': 0.2, 'A1': 0.0}
-    return mapping.get(sprache, 0.0)
+# numba lohnt die Kompilierzeit erst bei großen Tabellen
+numba_ab_zeilen = 100_000
 
-def normalize_lebenslauf(lebenslauf):
-    return (3 - lebenslauf) / 2.0
-
-def normalize_formalien(formalien):
-    return (3 - formalien) / 2.0
+w_note, w_motivation, w_sprache, w_lebenslauf, w_formalien = (
+    weights[k] for k in ['Note', 'Motivation', 'Sprache', 'Lebenslauf', 'Formalien']
+)
 
-def calculate_score(row):
-    score = 0
-    score += weights['Note'] * normalize_note(row['Note'])
-    score += weights['Motivation'] * normalize_motivation(row['Motivation'])
-    score += weights['Sprache'] * normalize_sprache(row['Sprache'])
-    score += weights['Lebenslauf'] * normalize_lebenslauf(row['Lebenslauf'])
-    score += weights['Formalien'] * normalize_formalien(row['Formalien'])
-    return score
+def score_formel(note, motivation, sprache, lebenslauf, formalien, bonus, malus):
+    # Elementweise Formel: direkt auf NumPy-Arrays oder als numba-ufunc in einem Durchlauf
+    score = w_note * ((5.0 - note) / 4.0)
+    score = score + w_motivation * ((3 - motivation) / 2.0)
+    score = score + w_sprache * sprache
+    score = score + w_lebenslauf * ((3 - lebenslauf) / 2.0)
+    score = score + w_formalien * ((3 - formalien) / 2.0)
+    return score + bonus_punkte * bonus - malus_punkte * malus
 
-students['Score'] = students.apply(calculate_score, axis=1)
+# Sprachniveau als Kategorie-Code; Code -1 (unbekannt) greift auf die angehängte 0.0 zu
+sprache_codes = pd.Categorical(students['Sprache'], categories=list(sprache_mapping)).codes
+sprache_lut = np.append(np.fromiter(sprache_mapping.values(), dtype=float), 0.0)
 
 # Besondere Chancen & Malus
-students.loc[
-    (students['BesondereChance:Behinderung'] == True) | (students['BesondereChance:Kind'] == True),
-    'Score'
-] += 0.6
-students.loc[
-    (students['Level'] == 'Bachelor') & (students['ECTS'] < 60),
-    'Score'
-] -= 0.2
+bonus = (
+    students['BesondereChance:Behinderung'].to_numpy(dtype=bool)
+    | students['BesondereChance:Kind'].to_numpy(dtype=bool)
+)
+is_bachelor = students['Level'].to_numpy() == 'Bachelor'
+malus = is_bachelor & (students['ECTS'].to_numpy() < 60)
+
+score_args = (
+    students['Note'].to_numpy(dtype=float),
+    students['Motivation'].to_numpy(dtype=float),
+    sprache_lut[sprache_codes],
+    students['Lebenslauf'].to_numpy(dtype=float),
+    students['Formalien'].to_numpy(dtype=float),
+    bonus,
+    malus,
+)
+if vectorize is not None and len(students) >= numba_ab_zeilen:
+    # Gleiche Formel als kompilierte ufunc: ein Durchlauf ohne Zwischenarrays
+    score_ufunc = vectorize(
+        ['float64(float64, float64, float64, float64, float64, boolean, boolean)'], cache=True
+    )(score_formel)
+    students['Score'] = score_ufunc(*score_args)
+else:
+    students['Score'] = score_formel(*score_args)
 
 # Präferenzgewichtung für Gasthochschule (optional)
 pref_weights = {1: 1.0, 2: 0.9, 3: 0.8, 4: 0.7, 5: 0.6}
-for pref in range(1, 6):
-    students[f'Score_Pref{pref}'] = students['Score'] / pref_weights.get(pref, 1.0) * pref_weights[pref]
+pref_cols = [f'Score_Pref{pref}' for pref in pref_weights]
+pref_mat = students['Score'].to_numpy()[:, None] * np.fromiter(pref_weights.values(), dtype=float)[None, :]
+students[pref_cols] = pref_mat
 
 # --- 3. Pyomo Modell ---
 student_ids = students['Matrikelnummer'].tolist()
-uni_ids = unis['ArbeitsnameUni'].tolist()
+
+# Nachschlagetabellen einmalig aufbauen statt DataFrame-Scans pro (s, u)
+score_of = dict(zip(students['Matrikelnummer'], students['Score']))
+semester_of = dict(zip(students['Matrikelnummer'], students['Semesterwahl']))
+
+# Eine Uni kann mehrere Zeilen haben (je Fachbereich) und wird als Ganzes betrachtet:
+# Kapazitäten werden summiert, Programme und Gleichverteilung gelten, wenn eine Zeile sie vorsieht
+programm_cols = [c for c in unis.columns if c.startswith('Programm-')]
+uni_daten = unis.groupby('ArbeitsnameUni', sort=False).agg({
+    'MaxBachelor': 'sum',
+    'MaxMaster': 'sum',
+    'MaxBeide': 'sum',
+    'GleicheAufteilungWISESOSE': 'any',
+    **{c: 'any' for c in programm_cols},
+})
+uni_ids = uni_daten.index.tolist()
+
+max_bachelor_of = uni_daten['MaxBachelor'].to_dict()
+max_master_of = uni_daten['MaxMaster'].to_dict()
+max_both_of = uni_daten['MaxBeide'].to_dict()
+gleiche_aufteilung_of = uni_daten['GleicheAufteilungWISESOSE'].to_dict()
+
+# Nur zulässige Paare (Uni bietet das Programm des Studierenden an) erhalten eine Variable
+# Angebotsmatrix (Uni x Programm) mit angehängter Leerspalte für unbekannte Programme (Code -1)
+angebot = np.zeros((len(uni_ids), len(programm_cols) + 1), dtype=bool)
+angebot[:, :-1] = uni_daten[programm_cols].to_numpy(dtype=bool)
+programm_codes = pd.Categorical(students['Programm'], categories=programm_cols).codes
+s_idx, u_idx = np.nonzero(angebot[:, programm_codes].T)
+# Absicherung gegen doppelte Paare (z. B. doppelte Studierendenzeilen), Reihenfolge bleibt erhalten
+feasible = list(dict.fromkeys(
+    (student_ids[i], uni_ids[j]) for i, j in zip(s_idx.tolist(), u_idx.tolist())
+))
+unis_of = {s: [] for s in student_ids}
+students_at = {u: [] for u in uni_ids}
+for s, u in feasible:
+    unis_of[s].append(u)
+    students_at[u].append(s)
 
 model = ConcreteModel()
 model.students = Set(initialize=student_ids)
 model.unis = Set(initialize=uni_ids)
-model.x = Var(model.students, model.unis, domain=Binary)
+model.pairs = Set(dimen=2, initialize=feasible)
+model.x = Var(model.pairs, domain=Binary)
 
 # Jeder Student genau eine Uni (nur wenn überhaupt eine möglich ist)
 def one_uni_per_student_rule(m, student):
-    return sum(m.x[student, university] for university in m.unis) <= 1
+    if not unis_of[student]:
+        return Constraint.Skip
+    return quicksum(m.x[student, university] for university in unis_of[student]) <= 1
 
 model.one_uni_per_student = Constraint(model.students, rule=one_uni_per_student_rule)
 
 # Kapazitätsbedingungen
-#def bachelor_capacity_rule(m, u):
-#    max_bachelor = unis.loc[unis['ArbeitsnameUni'] == u, 'MaxBachelor'].values[0]
-#    if max_bachelor == 0:
-#        # Keine Bachelor-Studierenden zulassen
-#        return sum(m.x[s, u] for s in m.students if students.loc[students['Matrikelnummer'] == s, 'Level'].values[0] == 'Bachelor') == 0
-#    else:
-#        return sum(m.x[s, u] for s in m.students if students.loc[students['Matrikelnummer'] == s, 'Level'].values[0] == 'Bachelor') <= max_bachelor
-#    
-#model.bachelor_capacity = Constraint(model.unis, rule=bachelor_capacity_rule)
-
-#def master_capacity_rule(m, u):
-#    max_master = unis.loc[unis['ArbeitsnameUni'] == u, 'MaxMaster'].values[0]
-#    if max_master == 0:
-#        # Keine Master-Studierenden zulassen
-#        return sum(m.x[s, u] for s in m.students if students.loc[students['Matrikelnummer'] == s, 'Level'].values[0] == 'Master') == 0
-#    else:
-#        return sum(m.x[s, u] for s in m.students if students.loc[students['Matrikelnummer'] == s, 'Level'].values[0] == 'Master') <= max_master
-#model.master_capacity = Constraint(model.unis, rule=master_capacity_rule)
-
-#def both_capacity_rule(m, u):
-#    max_both = unis.loc[unis['ArbeitsnameUni'] == u, 'MaxBeide'].values[0]
-#    return sum(m.x[s, u] for s in m.students) <= max_both
-#model.both_capacity = Constraint(model.unis, rule=both_capacity_rule)
+#is_master = students['Level'].to_numpy() == 'Master'
+#bachelor_ids = frozenset(students['Matrikelnummer'].to_numpy()[is_bachelor].tolist())
+#master_ids = frozenset(students['Matrikelnummer'].to_numpy()[is_master].tolist())
+#bachelors_at = {u: [s for s in students_at[u] if s in bachelor_ids] for u in uni_ids}
+#masters_at = {u: [s for s in students_at[u] if s in master_ids] for u in uni_ids}
+#
+# (Kandidaten je Uni, Kapazität je Uni) für Bachelor, Master und beide zusammen
+#kapazitaeten = {
+#    'Bachelor': (bachelors_at, max_bachelor_of),
+#    'Master': (masters_at, max_master_of),
+#    'Beide': (students_at, max_both_of),
+#}
+#
+#def capacity_rule(m, u, level):
+#    kandidaten, max_of = kapazitaeten[level]
+#    if not kandidaten[u]:
+#        return Constraint.Skip
+#    # Kapazität 0 schließt die Gruppe aus (binäre Variablen)
+#    return quicksum(m.x[s, u] for s in kandidaten[u]) <= max_of[u]
+#model.capacity = Constraint(model.unis, list(kapazitaeten), rule=capacity_rule)
 
 # Gleichverteilung WiSe/SoSe falls nötig
 #def gleiche_aufteilung_rule(m, u):
-#    if unis.loc[unis['ArbeitsnameUni'] == u, 'GleicheAufteilungWISESOSE'].values[0]:
-#        wise = sum(
-#            m.x[s, u]
-#            for s in m.students
-#            if students.loc[students['Matrikelnummer'] == s, 'Semesterwahl'].values[0] == 'WISE'
-#        )
-#        sose = sum(
-#            m.x[s, u]
-#            for s in m.students
-#            if students.loc[students['Matrikelnummer'] == s, 'Semesterwahl'].values[0] == 'SOSE'
-#        )
+#    if gleiche_aufteilung_of[u]:
+#        wise = quicksum(m.x[s, u] for s in students_at[u] if semester_of[s] == 'WISE')
+#        sose = quicksum(m.x[s, u] for s in students_at[u] if semester_of[s] == 'SOSE')
 #        # 'Egal' students are not counted for balancing
 #        diff = wise - sose
 #        return inequality(-1, diff, 1)
@@ -122,54 +247,36 @@ model.one_uni_per_student = Constraint(model.students, rule=one_uni_per_student_
 #        return Constraint.Feasible
 #model.gleiche_aufteilung = Constraint(model.unis, rule=gleiche_aufteilung_rule)
 
-# Programm-Match-Constraint (nur Unis mit passendem Programm)
-#def programm_match_rule(m, s, u):
-#    student_program = students.loc[students['Matrikelnummer'] == s, 'Programm'].values[0]
-#    colname = f'Programm-{str(student_program).zfill(2)}'
-#    if colname not in unis.columns:
-#        return m.x[s, u] == 0
-#    offers_program = unis.loc[unis['ArbeitsnameUni'] == u, colname].values[0]
-#    return m.x[s, u] <= int(offers_program)
-#model.programm_match = Constraint(model.students, model.unis, rule=programm_match_rule)
+# Programm-Match ist durch die Auswahl von model.pairs bereits sichergestellt
 
 # Ziel: Maximierung des Gesamtnutzwerts
 model.objective = Objective(
-    expr=sum(
-        students.loc[students['Matrikelnummer'] == s, 'Score'].values[0] * model.x[s, u]
-        for s in model.students for u in model.unis
-    ),
+    expr=quicksum(score_of[s] * model.x[s, u] for s, u in model.pairs),
     sense=maximize
 )
 
 # --- 4. Lösen ---
-solver = SolverFactory('highs')
+# HiGHS direkt über highspy im selben Prozess (ohne LP-Datei und Subprozess)
+solver = SolverFactory('appsi_highs')
 result = solver.solve(model)
 print("Solver Status:", result.solver.status)
 print("Termination Condition:", result.solver.termination_condition)
 
-import traceback
+# --- 5. Zuweisungen extrahieren ---
+x = model.x
+werte = np.array([x[s, u].value or 0.0 for s, u in feasible], dtype=np.float64)
+zuweisungen = [feasible[i] for i in np.flatnonzero(werte > 0.5)]
 
-try:
-    # --- 5. Zuweisungen extrahieren ---
-    zuweisungen = []
-    for s in model.students:
-        for u in model.unis:
-            val = model.x[s, u].value
-            if val is not None and val > 0.5:
-                zuweisungen.append({
-                    'Matrikelnummer': s,
-                    'Universität': u,
-                    'Score': students.loc[students['Matrikelnummer'] == s, 'Score'].values[0]
-                })
-
-    if zuweisungen:
-        print("Zuweisungen gefunden:", len(zuweisungen))
-        print("Erste 5 Zuweisungen:", zuweisungen[:5])
-        zuweisungen_df = pd.DataFrame(zuweisungen)
+if zuweisungen:
+    try:
+        zuweisungen_df = pd.DataFrame(zuweisungen, columns=['Matrikelnummer', 'Universität'])
+        zuweisungen_df['Score'] = zuweisungen_df['Matrikelnummer'].map(score_of)
+        print("Zuweisungen gefunden:", len(zuweisungen_df))
+        print("Erste 5 Zuweisungen:", zuweisungen_df.head().to_dict('records'))
         zuweisungen_df.to_csv('zuweisungen.csv', index=False)
         print("Datei gespeichert unter:", os.path.abspath('zuweisungen.csv'))
-    else:
-        print("Keine Zuweisungen gefunden.")
-except Exception as e:
-    print("Fehler beim Extrahieren der Zuweisungen:", e)
-    traceback.print_exc()
\ No newline at end of file
+    except Exception as e:
+        print("Fehler beim Speichern der Zuweisungen:", e)
+        traceback.print_exc()
+else:
+    print("Keine Zuweisungen gefunden.")